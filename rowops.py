@@ -1,4 +1,4 @@
-#! /bin/env python
+#! /usr/bin/env python3
 """
 Author: Christopher Mitchell <chris@chrismitchell.name>
 Date: 2011-09
@@ -8,12 +8,24 @@ Description: This program provides a fast and simple textual interface for
     command '?' for a listing of all commands.
 """
 
-from operator import mul, add
-from copy import deepcopy
-from fractions import Fraction
+try:
+    # quicktions is a compiled, drop-in replacement for fractions.Fraction
+    from quicktions import Fraction
+except ImportError:
+    from fractions import Fraction
+from collections import deque
+from itertools import chain
 import sys
 
+# the most changes the undo stack remembers; older ones are dropped first
+UNDO_LIMIT = 128
+
 class Matrix(object):
+    """
+    A matrix of Fractions stored as a list of rows. Row operations always
+    replace a row with a new list and never change a row list in place, so
+    the rows returned by `rows` stay valid as a record of earlier states.
+    """
     def __init__(self, n, k):
         """Create a zero-filled matrix with `n` equations and `k` unknowns."""
         self.n = n
@@ -22,52 +34,118 @@ class Matrix(object):
 
     def __str__(self):
         """Return a human-readable display of the matrix values."""
-        strings = [[str(self.mat[i][j]) for j in range(self.k)] for i in
-                range(self.n)]
-        str_width = max([max(len(elem) for elem in row) for row in strings])
-
-        result = ""
-        format_string = "{{:>{}}}".format(str_width+1)
-        for idx, row in enumerate(strings):
-            result += "R{} ".format(idx+1)
-            for elem in row:
-                result += format_string.format(elem)
-            result += "\n"
-        return result[:-1]
+        strings = [[str(elem) for elem in row] for row in self.mat]
+        str_width = max(map(len, chain.from_iterable(strings)))
+
+        row_format = ("%%%ds" % (str_width+1)) * self.k
+        return "\n".join("R%d " % (idx+1) + row_format % tuple(row)
+                for idx, row in enumerate(strings))
 
     def __repr__(self):
         return repr(self.mat)
 
     def copy(self):
-        return deepcopy(self)
+        """
+        Return a copy of the matrix. Fractions are immutable, so only the rows
+        themselves need to be copied.
+        """
+        new = Matrix.__new__(Matrix)
+        new.n, new.k = self.n, self.k
+        new.mat = [row[:] for row in self.mat]
+        return new
 
     @classmethod
     def _mult_row(cls, row, scalar):
         """Return the result of multiplying `row` by `scalar`."""
-        return map(mul, row, [scalar] * len(row))
+        p, q = scalar.numerator, scalar.denominator
+        return [Fraction(elem.numerator*p, elem.denominator*q) for elem in row]
 
     @classmethod
-    def _add_rows(cls, row_a, row_b):
-        """Return the result of summing `row_a` and `row_b`."""
-        return map(add, row_a, row_b)
+    def _is_integral(cls, row):
+        """Return whether every value in `row` is a whole number."""
+        return all(elem.denominator == 1 for elem in row)
+
+    def _check_rows(self, *rows):
+        """Raise IndexError unless every row number in `rows` is in range."""
+        n = self.n
+        for row in rows:
+            if not 1 <= row <= n:
+                raise IndexError("no row {}".format(row))
 
     def swap(self, a, b):
         """Swap rows `a` and `b`."""
+        self._check_rows(a, b)
         a -= 1
         b -= 1
         self.mat[a], self.mat[b] = self.mat[b], self.mat[a]
 
     def mult(self, a, scalar):
         """Multiply row `a` by `scalar`."""
+        self._check_rows(a)
         a -= 1
-        self.mat[a] = Matrix._mult_row(self.mat[a], scalar)
+        row = self.mat[a]
+        if scalar.denominator == 1 and Matrix._is_integral(row):
+            # Whole numbers can be combined as plain ints, skipping the gcd
+            # normalization that general Fraction arithmetic does per value.
+            p = scalar.numerator
+            self.mat[a] = [Fraction(elem.numerator * p) for elem in row]
+        else:
+            self.mat[a] = Matrix._mult_row(row, scalar)
 
     def add(self, scalar, a, b):
         """Add `scalar` times row `a` to row `b`."""
+        self._check_rows(a, b)
         a -= 1
         b -= 1
-        summand = Matrix._mult_row(self.mat[a], scalar)
-        self.mat[b] = Matrix._add_rows(summand, self.mat[b])
+        row_a = self.mat[a]
+        row_b = self.mat[b]
+        if (scalar.denominator == 1 and Matrix._is_integral(row_a) and
+                Matrix._is_integral(row_b)):
+            p = scalar.numerator
+            self.mat[b] = [Fraction(p*x.numerator + y.numerator)
+                    for x, y in zip(row_a, row_b)]
+        else:
+            # Build each sum straight from numerators and denominators rather
+            # than going through Fraction's operator dispatch twice per value.
+            p, q = scalar.numerator, scalar.denominator
+            self.mat[b] = [Fraction(
+                    x.numerator*p*y.denominator + y.numerator*x.denominator*q,
+                    x.denominator*q*y.denominator)
+                    for x, y in zip(row_a, row_b)]
+
+    def rows(self):
+        """
+        Return a list of the current rows. The row lists are shared with the
+        matrix, which is safe because row operations replace rows rather than
+        changing them, so passing the result to `set_rows` later restores
+        this state.
+        """
+        return list(self.mat)
+
+    def set_rows(self, rows):
+        """Replace every row of the matrix with the rows in `rows`."""
+        self.mat = list(rows)
+
+    def bareiss_step(self, i):
+        """
+        Use the pivot in row `i`, column `i` to clear that column in every row
+        below it, without introducing fractions (Bareiss elimination). Each of
+        those rows becomes (pivot*row - lead*row_i) / previous pivot, so a
+        matrix of whole numbers stays whole when the steps are done in order.
+        """
+        i -= 1
+        if not 0 <= i < min(self.n, self.k):
+            raise IndexError("no pivot in row {}".format(i+1))
+        row_i = self.mat[i]
+        pivot = row_i[i]
+        prev_pivot = self.mat[i-1][i-1] if i > 0 else 1
+        if pivot == 0 or prev_pivot == 0:
+            raise ValueError("pivot is zero")
+        for j in range(i+1, self.n):
+            row_j = self.mat[j]
+            lead = row_j[i]
+            self.mat[j] = [(pivot*y - lead*x) / prev_pivot
+                    for x, y in zip(row_i, row_j)]
 
 
 def modifies(fn):
@@ -103,13 +181,16 @@ class CLI(object):
 
         # used to keep a pristine copy of newly-created matrices so that users
         # can revert to its original state
-        self.start = self.mat
+        self.start = self.mat.copy()
 
-        # head of the undo stack is the state right before the current one
-        self.undo_stack = []
+        # head of the undo stack is the change that turns the current state
+        # back into the one before it, as a Matrix method name and arguments.
+        # Storing changes rather than whole matrices keeps each entry small.
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)
         # head of the log stack is natural description of the operation done to
-        # the last state to yield the current state.
-        self.log_stack = []
+        # the last state to yield the current state. It holds one more entry
+        # than the undo stack so that the two stay aligned once both are full.
+        self.log_stack = deque(maxlen=UNDO_LIMIT+1)
 
         self.commands_with_key = []
         self.commands_by_key = {}
@@ -117,6 +198,7 @@ class CLI(object):
         self.register('s', self.swap)
         self.register('m', self.mult)
         self.register('a', self.add)
+        self.register('b', self.bareiss)
         self.register('u', self.undo)
         self.register('r', self.revert)
         self.register('p', self.display)
@@ -127,17 +209,31 @@ class CLI(object):
     @help_text("show a log of your changes to the current matrix")
     def print_log(self):
         if len(self.log_stack) == 0:
-            print "No logs to print."
+            print("No logs to print.")
             return
 
-        for i in range(len(self.undo_stack)):
-            print self.log_stack[i]
-            print self.undo_stack[i]
-            print
+        # Rebuild the earlier states by undoing each change in turn on a copy
+        # of the current matrix.
+        mat = self.mat.copy()
+        states = []
+        for change in reversed(self.undo_stack):
+            CLI._apply(mat, change)
+            states.append(str(mat))
+        states.reverse()
+
+        for log, state in zip(self.log_stack, states):
+            print(log)
+            print(state)
+            print()
         # Recall that the last log message corresponds to the operation that
         # produced the current matrix.
-        print self.log_stack[-1]
-        print self.mat
+        print(self.log_stack[-1])
+        print(self.mat)
+
+    @staticmethod
+    def _apply(mat, change):
+        """Apply `change`, a (method name, arguments...) tuple, to `mat`."""
+        getattr(mat, change[0])(*change[1:])
 
     def register(self, key, fn):
         """
@@ -146,41 +242,44 @@ class CLI(object):
         the matrix.
         """
         self.commands_with_key.append((fn, key))
-        self.commands_by_key[key] = fn
+        # look up whether the command modifies the matrix once, here, rather
+        # than on every keystroke in the console loop
+        self.commands_by_key[key] = (fn, getattr(fn, "modifies", False))
 
     @modifies
     @help_text("create a new matrix")
     def new(self):
-        print "Create a matrix with n rows and k columns."
+        print("Create a matrix with n rows and k columns.")
         try:
-            n = int(raw_input("How many rows? "))
-            k = int(raw_input("How many columns? "))
+            n = int(input("How many rows? "))
+            k = int(input("How many columns? "))
         except ValueError:
-            print "! Oops! Please try again, inputting integers."
+            print("! Oops! Please try again, inputting integers.")
             return 0
 
         mat = Matrix(n, k)
 
-        print ("Enter your data one row at a time, separating the numbers with spaces.")
+        print("Enter your data one row at a time, separating the numbers with spaces.")
+        _Fraction = Fraction
         for row_idx in range(n):
             numbers = []
             while True:
-                user_input = raw_input("R{}: ".format(row_idx+1))
+                user_input = input("R{}: ".format(row_idx+1))
                 try:
-                    numbers = [Fraction(num.strip()) for num in
-                            user_input.strip().split(" ")]
+                    numbers = [_Fraction(num) for num in user_input.split()]
                 except ValueError:
-                    print "! Could not parse your input as numbers."
+                    print("! Could not parse your input as numbers.")
                     continue
                 if len(numbers) != k:
-                    print "! You entered {} numbers, but the system expects {}. Please try again.".format(len(numbers), k)
+                    print("! You entered {} numbers, but the system expects {}. Please try again.".format(len(numbers), k))
                     continue
                 else:
                     break
             mat.mat[row_idx] = numbers
 
-        self.undo_stack = []
-        self.log_stack = ["Create a new {} by {} matrix.".format(n, k)]
+        self.undo_stack.clear()
+        self.log_stack.clear()
+        self.log_stack.append("Create a new {} by {} matrix.".format(n, k))
         self.start = mat.copy()
         self.mat = mat
         return 1
@@ -188,81 +287,118 @@ class CLI(object):
     @modifies
     @help_text("revert the matrix to its original state")
     def revert(self):
-        self.undo_stack = []
-        self.log_stack = []
-        self.mat = self.start
+        self.undo_stack.clear()
+        self.log_stack.clear()
+        self.mat = self.start.copy()
         return 1
 
     @modifies
     @help_text("swap one row for another")
     def swap(self):
-        print "Swap two rows."
+        print("Swap two rows.")
         try:
-            row_a = int(raw_input("Row A: "))
-            row_b = int(raw_input("Row B: "))
+            row_a = int(input("Row A: "))
+            row_b = int(input("Row B: "))
         except ValueError:
-            print "! Your input was not understood. Try the row number by itself."
+            print("! Your input was not understood. Try the row number by itself.")
             return 0
-        self.undo_stack.append(self.mat.copy())
+        try:
+            self.mat.swap(row_a, row_b)
+        except IndexError:
+            print("! Invalid row number.")
+            return 0
+        self.undo_stack.append(("swap", row_a, row_b))
         self.log_stack.append("Swap R{} with R{}".format(row_a, row_b))
-        self.mat.swap(row_a, row_b)
         return 1
 
     @modifies
     @help_text("multiply a row by some value")
     def mult(self):
-        print "Multiply a row."
+        print("Multiply a row.")
         try:
-            row = int(raw_input("Row: "))
-            multiplier = Fraction(raw_input("Multiplier: "))
+            row = int(input("Row: "))
+            multiplier = Fraction(input("Multiplier: "))
         except ValueError:
-            print "! Your input was not understood. Please try again."
+            print("! Your input was not understood. Please try again.")
             return 0
-        self.undo_stack.append(self.mat.copy())
+        if multiplier == 0:
+            print("! Multiplying a row by zero cannot be undone.")
+            return 0
+        try:
+            self.mat.mult(row, multiplier)
+        except IndexError:
+            print("! Invalid row number.")
+            return 0
+        self.undo_stack.append(("mult", row, 1 / multiplier))
         self.log_stack.append("Multiply R{} by {}".format(row, multiplier))
-        self.mat.mult(row, multiplier)
         return 1
         
     @modifies
     @help_text("add a multiple of one row to another row")
     def add(self):
-        print "Add n times row A to row B."
+        print("Add n times row A to row B.")
         try:
-            multiplier = Fraction(raw_input("Multiplier: "))
-            row_a = int(raw_input("Row A: "))
-            row_b = int(raw_input("Row B: "))
+            multiplier = Fraction(input("Multiplier: "))
+            row_a = int(input("Row A: "))
+            row_b = int(input("Row B: "))
         except ValueError:
-            print "! Your input did not look like numbers."
+            print("! Your input did not look like numbers.")
             return 0
-        else:
-            if not (1 <= row_a <= self.mat.k) or not (1 <= row_b <= self.mat.k):
-                print "! Invalid row number."
-                return 0
-        self.undo_stack.append(self.mat.copy())
+        if row_a == row_b:
+            print("! Row A and row B must be different rows.")
+            return 0
+        try:
+            self.mat.add(multiplier, row_a, row_b)
+        except IndexError:
+            print("! Invalid row number.")
+            return 0
+        self.undo_stack.append(("add", -multiplier, row_a, row_b))
         self.log_stack.append("Add {} times R{} to R{}".format(
             multiplier, row_a, row_b))
-        self.mat.add(multiplier, row_a, row_b)
+        return 1
+
+    @modifies
+    @help_text("clear a column below its pivot without fractions (Bareiss)")
+    def bareiss(self):
+        print("Clear below the pivot in row A, column A.")
+        try:
+            row = int(input("Row A: "))
+        except ValueError:
+            print("! Your input was not understood. Try the row number by itself.")
+            return 0
+        rows = self.mat.rows()
+        try:
+            self.mat.bareiss_step(row)
+        except IndexError:
+            print("! Invalid row number.")
+            return 0
+        except ValueError:
+            print("! The pivot (or the one before it) is zero. Swap rows first.")
+            return 0
+        self.undo_stack.append(("set_rows", rows))
+        self.log_stack.append("Bareiss step on R{}".format(row))
         return 1
 
     @help_text("show the current matrix")
     def display(self):
-        print self.mat
+        print(self.mat)
 
     @modifies
     @help_text("undo the latest change to the matrix")
     def undo(self):
         try:
-            self.mat = self.undo_stack.pop()
-            self.log_stack.pop()
-            return 1
+            change = self.undo_stack.pop()
         except IndexError:
-            print "! No change to undo."
+            print("! No change to undo.")
             return 0
+        CLI._apply(self.mat, change)
+        self.log_stack.pop()
+        return 1
 
     @help_text("show this list of commands and their descriptions")
     def command_info(self):
         for fn, key in self.commands_with_key:
-            print "  {} - {}".format(key, fn.__dict__.get("help_text", ""))
+            print("  {} - {}".format(key, fn.__dict__.get("help_text", "")))
 
     @help_text("quit the program")
     def quit(self):
@@ -270,27 +406,26 @@ class CLI(object):
 
     def run_console(self):
         """Start the interactive console."""
-        print "Use the '?' command for help."
+        print("Use the '?' command for help.")
         while True:
             try:
-                key = raw_input("> ")
+                key = input("> ")
             except (KeyboardInterrupt, EOFError):
-                print
+                print()
                 self.quit()
 
-            try:
-                cmd = self.commands_by_key[key]
-            except KeyError:
-                print "That command is unrecognized. Try '?' for help."
-                print
+            cmd, modifies = self.commands_by_key.get(key, (None, False))
+            if cmd is None:
+                print("That command is unrecognized. Try '?' for help.")
+                print()
                 continue
 
             success = cmd()
-            if success and cmd.modifies:
-                print 
-                print "Result:"
-                print self.mat
-            print
+            if success and modifies:
+                print()
+                print("Result:")
+                print(self.mat)
+            print()
 
 
 if __name__ == "__main__":